@@ -1,15 +1,23 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel, validator
 from datetime import datetime
-import joblib
 import numpy as np
+import orjson
+import xgboost as xgb
 import pandas as pd
 import logging
-from typing import Optional
+import asyncio
+from collections import OrderedDict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
 import json
 import os
 
+from pipeline import N_FEATURES, confidence_nb, load_base_models, prepare_features, run_base_ensemble
+
 # --------------------------------------------------
 # Configure logging
 # --------------------------------------------------
@@ -19,21 +27,28 @@ logger = logging.getLogger(__name__)
 # --------------------------------------------------
 # Initialize FastAPI app
 # --------------------------------------------------
-app = FastAPI(title="Groundwater Prediction API", version="1.0.0")
+app = FastAPI(
+    title="Groundwater Prediction API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # --------------------------------------------------
 # Load ML models and preprocessing objects
 # --------------------------------------------------
 try:
     # Load all required models and objects
-    scaler = joblib.load("saved_models/scaler_1.joblib")
-    best_xgb = joblib.load("saved_models/xgb_model_1.joblib")
-    stacking_model = joblib.load("saved_models/stacking_model_1.joblib")
-    residual_model = joblib.load("saved_models/residual_model_1.joblib")
+    base_models = load_base_models()
     
-    # Load ensemble weights
-    with open("saved_models/ensemble_weights_1.json", 'r') as f:
-        ensemble_weights = json.load(f)
+    # Optional single booster distilled from the full ensemble (distill_model.py).
+    # It was only fit on lat 6-37.5, long 68-97.5 (India) and years 1994-2024;
+    # outside that domain its answers can drift from the full ensemble.
+    distilled_model = None
+    if os.getenv("USE_DISTILLED_MODEL") == "1":
+        distilled_model = xgb.Booster()
+        distilled_model.load_model("saved_models/distilled_model_1.ubj")
+        distilled_model.set_param({"nthread": 1})
+        logger.info("✅ Using distilled ensemble model")
     
     # Load metadata to get feature information
     with open("saved_models/training_metadata_1.json", 'r') as f:
@@ -48,16 +63,8 @@ except Exception as e:
     logger.error(f"❌ Error loading models: {e}")
     raise RuntimeError(f"Failed to load models: {e}")
 
-# Global variables from training
-year_min = 1994  # Replace with actual min year from your data
-year_max = 2024  # Replace with actual max year from your data
 features = training_metadata['features']
 
-# Precomputed mean values from your training data
-spatial_lag_mean = 12.5  # Replace with actual mean from your training
-prev_measurement_mean = 11.8  # Replace with actual mean from your training
-prev_year_measurement_mean = 12.1  # Replace with actual mean from your training
-
 # --------------------------------------------------
 # Enable CORS (for React Native app)
 # --------------------------------------------------
@@ -72,6 +79,9 @@ app.add_middleware(
 # --------------------------------------------------
 # Pydantic Models for Input/Output
 # --------------------------------------------------
+# Largest /predict_batch request; also the size of the per-thread feature buffer
+MAX_BATCH = 1024
+
 class PredictionInput(BaseModel):
     latitude: float
     longitude: float
@@ -102,54 +112,94 @@ class PredictionOutput(BaseModel):
     confidence: Optional[float] = None
     units: str = "meters below ground level"
 
+class BatchPredictionInput(BaseModel):
+    items: List[PredictionInput]
+
+    @validator("items")
+    def validate_batch_size(cls, v):
+        if len(v) > MAX_BATCH:
+            raise ValueError(f"At most {MAX_BATCH} items per batch")
+        return v
+
+class BatchPredictionOutput(BaseModel):
+    predictions: List[float]
+    confidences: List[float]
+    units: str = "meters below ground level"
+
 # --------------------------------------------------
 # Utility Functions
 # --------------------------------------------------
-def prepare_features(latitude: float, longitude: float, date_str: str):
-    """Prepare all 65 features from just lat, long, and date"""
-    date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-    
-    # Extract date components
-    day = date_obj.day
-    month = date_obj.month
-    year = date_obj.year
-    day_of_year = date_obj.timetuple().tm_yday
-    
-    # Create cyclical features
-    doy_sin = np.sin(2 * np.pi * day_of_year/365)
-    doy_cos = np.cos(2 * np.pi * day_of_year/365)
-    month_sin = np.sin(2 * np.pi * month/12)
-    month_cos = np.cos(2 * np.pi * month/12)
-    year_sin = np.sin(2 * np.pi * (year - year_min) / (year_max - year_min))
-    year_cos = np.cos(2 * np.pi * (year - year_min) / (year_max - year_min))
-    
-    # Seasonal features
-    is_summer = 1 if month in [4, 5, 6] else 0
-    is_winter = 1 if month in [11, 12, 1] else 0
-    is_spring = 1 if month in [2, 3] else 0
-    
-    # Use precomputed mean values for features that require historical data
-    spatial_lag_est = spatial_lag_mean
-    prev_measurement_est = prev_measurement_mean
-    prev_year_measurement_est = prev_year_measurement_mean
-    
-    # Simple cluster assignment based on coordinates
-    cluster_features = [0] * 50
-    cluster_idx = int((abs(latitude) + abs(longitude)) % 50)
-    cluster_features[cluster_idx] = 1
-    
-    # Create the full feature array in the exact order used during training
-    feature_values = [
-        latitude, longitude, doy_sin, doy_cos, month_sin, month_cos, 
-        year, year_sin, year_cos, is_summer, is_winter, is_spring,
-        spatial_lag_est, prev_measurement_est, prev_year_measurement_est
-    ] + cluster_features
-    
-    return np.array([feature_values])
+def _run_ensemble(X_scaled):
+    """Run the models on scaled features, returning predictions and confidences"""
+    if distilled_model is None:
+        return run_base_ensemble(base_models, X_scaled)
+
+    # One booster reproduces the whole ensemble in a single call
+    final_prediction = distilled_model.inplace_predict(
+        X_scaled,
+        missing=np.nan,
+        validate_features=False
+    )
+    confidence = np.empty(final_prediction.shape[0])
+    confidence_nb(final_prediction, confidence)
+    return final_prediction, confidence
+
+# Feature matrices are reused per inference thread instead of allocated per call
+_thread_buffers = threading.local()
+
+def _feature_buffer(n_rows: int):
+    """(n_rows, 65) view of this thread's feature buffer"""
+    if n_rows > MAX_BATCH:
+        return np.empty((n_rows, N_FEATURES), dtype=np.float32)
+    buf = getattr(_thread_buffers, "features", None)
+    if buf is None:
+        buf = _thread_buffers.features = np.empty((MAX_BATCH, N_FEATURES), dtype=np.float32)
+    return buf[:n_rows]
+
+# Coordinates are quantized to 3 decimals (~100 m, the wells API tolerance) so
+# /predict, its cache and /predict_batch all answer the same for one location
+COORD_DECIMALS = 3
+
+def predict_batch_arrays(samples: Sequence[Tuple[float, float, str]]):
+    """Run the full pipeline once on an (N, 65) matrix of (lat, long, date) samples"""
+    # Features come out of the kernel already standardized
+    X_scaled = _feature_buffer(len(samples))
+    for i, (latitude, longitude, date_str) in enumerate(samples):
+        prepare_features(
+            round(latitude, COORD_DECIMALS),
+            round(longitude, COORD_DECIMALS),
+            date_str,
+            base_models.tables,
+            out=X_scaled[i]
+        )
+
+    return _run_ensemble(X_scaled)
 
-def weighted_ensemble_predictions(xgb_pred, stacking_pred, weights):
-    """Combine predictions using optimized weights"""
-    return weights[0] * xgb_pred + weights[1] * stacking_pred
+# Model inference blocks, so it runs here instead of on the event loop.
+# XGBoost and sklearn release the GIL in their native code.
+_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Predictions are deterministic, so single-sample requests are memoized on
+# the quantized coordinates. The cache is only touched from the event loop,
+# so hits are answered without a lock or an executor hop.
+PREDICTION_CACHE_SIZE = 65536
+_prediction_cache: "OrderedDict[Tuple[float, float, str], Tuple[float, float]]" = OrderedDict()
+
+def _cache_get(key: Tuple[float, float, str]) -> Optional[Tuple[float, float]]:
+    result = _prediction_cache.get(key)
+    if result is not None:
+        _prediction_cache.move_to_end(key)
+    return result
+
+def _cache_put(key: Tuple[float, float, str], result: Tuple[float, float]):
+    _prediction_cache[key] = result
+    if len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+        _prediction_cache.popitem(last=False)
+
+def predict_single(lat_q: float, lon_q: float, date_str: str) -> Tuple[float, float]:
+    """Prediction and confidence for one quantized (lat, long, date) key"""
+    predictions, confidences = predict_batch_arrays([(lat_q, lon_q, date_str)])
+    return float(predictions[0]), float(confidences[0])
 
 # --------------------------------------------------
 # API Routes
@@ -161,40 +211,24 @@ async def predict(input_data: PredictionInput):
     """
     try:
         logger.info(f"Received prediction request: {input_data}")
-        
-        # Prepare all 65 features from the 3 input values
-        features_array = prepare_features(
-            input_data.latitude, 
-            input_data.longitude, 
+
+        key = (
+            round(input_data.latitude, COORD_DECIMALS),
+            round(input_data.longitude, COORD_DECIMALS),
             input_data.date
         )
-        
-        # Scale the features
-        features_scaled = scaler.transform(features_array)
-        
-        # Get predictions from base models
-        xgb_pred = best_xgb.predict(features_scaled)[0]
-        stacking_pred = stacking_model.predict(features_scaled)[0]
-        
-        # Combine predictions using optimized weights
-        ensemble_pred = weighted_ensemble_predictions(
-            xgb_pred, 
-            stacking_pred, 
-            [ensemble_weights['xgb_weight'], ensemble_weights['stacking_weight']]
-        )
-        
-        # Apply residual correction
-        residual_pred = residual_model.predict(features_scaled)[0]
-        final_prediction = ensemble_pred + residual_pred
+        result = _cache_get(key)
+        if result is None:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(_EXECUTOR, predict_single, *key)
+            _cache_put(key, result)
+        prediction, confidence = result
 
-        # Calculate confidence (simple heuristic based on prediction range)
-        confidence = max(0.7, 1.0 - abs(final_prediction - 10) / 20)
+        logger.info(f"Prediction completed: {prediction:.2f} meters")
 
-        logger.info(f"Prediction completed: {final_prediction:.2f} meters")
-        
         return PredictionOutput(
-            prediction=float(final_prediction),
-            confidence=float(confidence),
+            prediction=prediction,
+            confidence=confidence,
             units="meters below ground level"
         )
 
@@ -203,6 +237,38 @@ async def predict(input_data: PredictionInput):
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 
+@app.post("/predict_batch", response_model=BatchPredictionOutput)
+async def predict_batch(input_data: BatchPredictionInput):
+    """
+    Predict groundwater levels for many (latitude, longitude, date) inputs in one call
+    """
+    try:
+        logger.info(f"Received batch prediction request: {len(input_data.items)} items")
+
+        if not input_data.items:
+            return BatchPredictionOutput(predictions=[], confidences=[])
+
+        loop = asyncio.get_running_loop()
+        predictions, confidences = await loop.run_in_executor(
+            _EXECUTOR,
+            predict_batch_arrays,
+            [(item.latitude, item.longitude, item.date) for item in input_data.items]
+        )
+
+        logger.info(f"Batch prediction completed: {len(predictions)} predictions")
+
+        # orjson serializes the NumPy arrays directly, no .tolist() round trip
+        return ORJSONResponse(content={
+            "predictions": predictions,
+            "confidences": confidences,
+            "units": "meters below ground level"
+        })
+
+    except Exception as e:
+        logger.error(f"Batch prediction failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -216,16 +282,20 @@ async def health_check():
     }
 
 
+# Static, so serialized once at startup
+ROOT_JSON = orjson.dumps({
+    "message": "Groundwater Prediction API",
+    "version": "1.0.0",
+    "input_required": ["latitude", "longitude", "date (YYYY-MM-DD)"],
+    "output": "predicted_water_level (meters below ground)",
+    "endpoint": "POST /predict",
+    "batch_endpoint": "POST /predict_batch"
+})
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
-    return {
-        "message": "Groundwater Prediction API",
-        "version": "1.0.0",
-        "input_required": ["latitude", "longitude", "date (YYYY-MM-DD)"],
-        "output": "predicted_water_level (meters below ground)",
-        "endpoint": "POST /predict"
-    }
+    return Response(content=ROOT_JSON, media_type="application/json")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+"""
+Distill the weighted XGBoost + stacking + residual ensemble into one XGBoost
+booster, so serving needs a single model call instead of three.
+
+The ensemble is sampled on synthetic (lat, long, date) inputs through the same
+feature kernel the API uses, and a booster is fit to its outputs. Samples only
+cover India (LAT_RANGE/LON_RANGE) and the training years, so the distilled
+model is only checked inside that domain. Enable it in app.py with
+USE_DISTILLED_MODEL=1; the original models remain the default.
+
+Run from the backend directory: python distill_model.py [n_samples]
+"""
+import logging
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import xgboost as xgb
+
+import pipeline
+
+# --------------------------------------------------
+# Configure logging
+# --------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DISTILLED_MODEL_PATH = "saved_models/distilled_model_1.ubj"
+
+# Sampling domain: India, matching the wells dataset
+LAT_RANGE = (6.0, 37.5)
+LON_RANGE = (68.0, 97.5)
+
+
+def sample_features(n_samples: int, rng: np.random.Generator, tables: pipeline.ScalingTables):
+    """Scaled feature matrix for uniformly sampled locations and dates"""
+    latitudes = rng.uniform(*LAT_RANGE, n_samples)
+    longitudes = rng.uniform(*LON_RANGE, n_samples)
+    first_day = date(pipeline.year_min, 1, 1).toordinal()
+    last_day = date(pipeline.year_max, 12, 31).toordinal()
+    days = rng.integers(first_day, last_day + 1, n_samples)
+
+    X_scaled = np.empty((n_samples, pipeline.N_FEATURES), dtype=np.float32)
+    for i in range(n_samples):
+        pipeline.prepare_features(
+            latitudes[i],
+            longitudes[i],
+            date.fromordinal(int(days[i])).isoformat(),
+            tables,
+            out=X_scaled[i]
+        )
+    return X_scaled
+
+
+def distill(n_samples: int = 500_000, seed: int = 0):
+    """Fit a single booster to the ensemble's predictions and save it"""
+    # Always the original models, whatever USE_DISTILLED_MODEL is set to
+    base_models = pipeline.load_base_models(nthread=os.cpu_count())
+    rng = np.random.default_rng(seed)
+    X_scaled = sample_features(n_samples, rng, base_models.tables)
+    y, _ = pipeline.run_base_ensemble(base_models, X_scaled)
+    logger.info(f"📊 Labelled {n_samples:,} synthetic samples with the full ensemble")
+
+    n_train = int(n_samples * 0.9)
+    model = xgb.XGBRegressor(
+        n_estimators=800,
+        max_depth=8,
+        learning_rate=0.05,
+        tree_method="hist",
+        early_stopping_rounds=50
+    )
+    model.fit(
+        X_scaled[:n_train], y[:n_train],
+        eval_set=[(X_scaled[n_train:], y[n_train:])],
+        verbose=False
+    )
+
+    holdout = model.predict(X_scaled[n_train:])
+    rmse = float(np.sqrt(np.mean((holdout - y[n_train:]) ** 2)))
+    # The holdout is drawn from the same domain, so this says nothing about
+    # inputs outside LAT_RANGE/LON_RANGE or the training years
+    logger.info(f"✅ Distilled model RMSE vs ensemble on in-domain holdout: {rmse:.4f} m")
+
+    # Keep only the trees up to the best iteration so plain booster calls match
+    model.get_booster()[: model.best_iteration + 1].save_model(DISTILLED_MODEL_PATH)
+    logger.info(f"✅ Saved {DISTILLED_MODEL_PATH}")
+
+
+if __name__ == "__main__":
+    distill(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000)
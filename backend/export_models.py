@@ -0,0 +1,30 @@
+"""
+Export the trained XGBoost model in native UBJSON (xgb_model_1.ubj), which
+app.py loads in preference to the pickled joblib file. The native format does
+not depend on the xgboost/sklearn versions used to pickle the model.
+
+Run from the backend directory: python export_models.py
+"""
+import joblib
+import logging
+import os
+
+# --------------------------------------------------
+# Configure logging
+# --------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = "saved_models"
+
+
+def export_models(model_dir: str = MODEL_DIR):
+    """Export the XGBoost model to .ubj"""
+    best_xgb = joblib.load(os.path.join(model_dir, "xgb_model_1.joblib"))
+    ubj_path = os.path.join(model_dir, "xgb_model_1.ubj")
+    best_xgb.save_model(ubj_path)
+    logger.info(f"✅ Saved {ubj_path}")
+
+
+if __name__ == "__main__":
+    export_models()
@@ -0,0 +1,42 @@
+"""
+One-time migration for the wells collection: add a GeoJSON location point to
+every record and build the 2dsphere index /well-details uses for $geoWithin.
+
+Records inserted later should carry the location field themselves; until they
+do, /well-details still finds them through the latitude/longitude match.
+
+Run once against the database: python migrate_well_locations.py
+"""
+import logging
+
+from pymongo import MongoClient
+
+# --------------------------------------------------
+# Configure logging
+# --------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MONGODB_URI = "mongodb://localhost:27017/"
+
+
+def migrate_well_locations(uri: str = MONGODB_URI):
+    """Add a GeoJSON location to records missing one and index it"""
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    wells_collection = client.groundwaterDB.wells
+
+    result = wells_collection.update_many(
+        {"location": {"$exists": False}},
+        [{"$set": {"location": {
+            "type": "Point",
+            "coordinates": ["$LONGITUDE", "$LATITUDE"]
+        }}}]
+    )
+    logger.info(f"📍 Added locations to {result.modified_count:,} records")
+
+    wells_collection.create_index([("location", "2dsphere")])
+    logger.info("✅ 2dsphere index on location is ready")
+
+
+if __name__ == "__main__":
+    migrate_well_locations()
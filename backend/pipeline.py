@@ -0,0 +1,248 @@
+"""
+Feature preparation and base-ensemble inference shared by app.py and
+distill_model.py.
+
+Importing this module has no side effects beyond building the constant lookup
+tables: models are only read when load_base_models() is called.
+"""
+import json
+import os
+from datetime import datetime
+from typing import NamedTuple, Tuple
+
+import joblib
+import numpy as np
+import xgboost as xgb
+from numba import njit
+
+MODEL_DIR = "saved_models"
+
+# Global variables from training
+year_min = 1994  # Replace with actual min year from your data
+year_max = 2024  # Replace with actual max year from your data
+
+# Precomputed mean values from your training data
+spatial_lag_mean = 12.5  # Replace with actual mean from your training
+prev_measurement_mean = 11.8  # Replace with actual mean from your training
+prev_year_measurement_mean = 12.1  # Replace with actual mean from your training
+
+# Number of features the models were trained on: 15 dense + 50 cluster one-hot
+N_FEATURES = 65
+
+# Lookup tables for the cyclical features. The inputs are small discrete sets
+# (day of year, month, year within the cycle), so the sin/cos values are
+# computed once here; Numba freezes these module arrays into the kernel.
+_TWO_PI = 2 * np.pi
+_INV_365 = 1.0 / 365
+_INV_12 = 1.0 / 12
+_YEAR_SPAN = year_max - year_min  # One full cycle of the year feature
+_YEAR_INV_SPAN = 1.0 / _YEAR_SPAN
+
+_DOY_ANGLE = _TWO_PI * np.arange(1, 367) * _INV_365
+_DOY_SIN = np.sin(_DOY_ANGLE).astype(np.float32)
+_DOY_COS = np.cos(_DOY_ANGLE).astype(np.float32)
+_MONTH_ANGLE = _TWO_PI * np.arange(1, 13) * _INV_12
+_MONTH_SIN = np.sin(_MONTH_ANGLE).astype(np.float32)
+_MONTH_COS = np.cos(_MONTH_ANGLE).astype(np.float32)
+_YEAR_ANGLE = _TWO_PI * np.arange(_YEAR_SPAN) * _YEAR_INV_SPAN
+_YEAR_SIN = np.sin(_YEAR_ANGLE).astype(np.float32)
+_YEAR_COS = np.cos(_YEAR_ANGLE).astype(np.float32)
+
+# (is_summer, is_winter, is_spring) by month; row 0 is unused
+_SEASON_FLAGS = np.zeros((13, 3), dtype=np.float32)
+_SEASON_FLAGS[[4, 5, 6], 0] = 1.0
+_SEASON_FLAGS[[11, 12, 1], 1] = 1.0
+_SEASON_FLAGS[[2, 3], 2] = 1.0
+
+
+class ScalingTables(NamedTuple):
+    """Scaler parameters, applied inline by the feature kernel instead of scaler.transform"""
+    mean: np.ndarray
+    inv_scale: np.ndarray
+    # Columns 12-14 are constants, so their scaled values never change
+    const_scaled: np.ndarray
+    # Row k is the scaled 50-column cluster block when cluster_idx == k
+    cluster_scaled: np.ndarray
+
+
+def build_scaling_tables(scaler) -> ScalingTables:
+    """Precompute the kernel's scaling tables from a fitted StandardScaler"""
+    return ScalingTables(
+        mean=np.asarray(scaler.mean_, dtype=np.float32),
+        inv_scale=(1.0 / np.asarray(scaler.scale_, dtype=np.float64)).astype(np.float32),
+        const_scaled=(
+            (np.array([spatial_lag_mean, prev_measurement_mean, prev_year_measurement_mean]) - scaler.mean_[12:15])
+            / scaler.scale_[12:15]
+        ).astype(np.float32),
+        cluster_scaled=np.ascontiguousarray(
+            (np.eye(50) - scaler.mean_[15:65]) / scaler.scale_[15:65],
+            dtype=np.float32
+        )
+    )
+
+
+@njit("void(float64, float64, int64, int64, int64, "
+      "float32[:], float32[:], float32[:], float32[:, ::1], float32[:])",
+      cache=True, fastmath=True, nogil=True)
+def _prepare_features_nb(lat, lon, year, month, day_of_year,
+                         sc_mean, sc_invscale, const_scaled, cluster_scaled, out):
+    """Fill ``out`` (length 65) with the standardized feature vector in training order"""
+    # year_min and _YEAR_SPAN are compile-time constants, so no runtime division
+    year_idx = (year - year_min) % _YEAR_SPAN
+
+    out[0] = lat
+    out[1] = lon
+    # Cyclical features
+    out[2] = _DOY_SIN[day_of_year - 1]
+    out[3] = _DOY_COS[day_of_year - 1]
+    out[4] = _MONTH_SIN[month - 1]
+    out[5] = _MONTH_COS[month - 1]
+    out[6] = year
+    out[7] = _YEAR_SIN[year_idx]
+    out[8] = _YEAR_COS[year_idx]
+    # Seasonal features
+    out[9] = _SEASON_FLAGS[month, 0]
+    out[10] = _SEASON_FLAGS[month, 1]
+    out[11] = _SEASON_FLAGS[month, 2]
+
+    # Standardize the dense columns: (x - mean) / scale
+    for j in range(12):
+        out[j] = (out[j] - sc_mean[j]) * sc_invscale[j]
+
+    # Precomputed means for features that require historical data, already scaled
+    out[12:15] = const_scaled
+
+    # Simple cluster assignment based on coordinates, copied as a prescaled row
+    cluster_idx = int((abs(lat) + abs(lon)) % 50)
+    out[15:] = cluster_scaled[cluster_idx]
+
+
+def prepare_features(latitude: float, longitude: float, date_str: str,
+                     tables: ScalingTables, out=None):
+    """Prepare all 65 scaled features from just lat, long, and date"""
+    date_obj = datetime.strptime(date_str, "%Y-%m-%d")
+    if out is None:
+        out = np.empty(N_FEATURES, dtype=np.float32)
+
+    _prepare_features_nb(
+        latitude, longitude,
+        date_obj.year, date_obj.month, date_obj.timetuple().tm_yday,
+        tables.mean, tables.inv_scale, tables.const_scaled, tables.cluster_scaled,
+        out
+    )
+    return out
+
+
+# Compiled lazily: the models' output dtypes (float32/float64) are only known at
+# runtime. cache=True keeps the compiled code across restarts.
+@njit(cache=True, fastmath=True, nogil=True)
+def _confidence(prediction):
+    """Simple heuristic based on prediction range"""
+    c = 1.0 - abs(prediction - 10.0) / 20.0
+    return c if c > 0.7 else 0.7
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _finalize_nb(xgb_pred, stacking_pred, residual_pred, w_xgb, w_stacking, out_pred, out_conf):
+    """Weighted ensemble + residual correction + confidence in a single pass"""
+    for i in range(xgb_pred.shape[0]):
+        p = w_xgb * xgb_pred[i] + w_stacking * stacking_pred[i] + residual_pred[i]
+        out_pred[i] = p
+        out_conf[i] = _confidence(p)
+
+@njit(cache=True, fastmath=True, nogil=True)
+def confidence_nb(pred, out_conf):
+    """Confidence for each prediction of a single model"""
+    for i in range(pred.shape[0]):
+        out_conf[i] = _confidence(pred[i])
+
+
+def _cast_linear_params_to_float32(model):
+    """Store fitted linear coefficients as float32 so float32 inputs are not upcast"""
+    # Only plain fitted attributes: on e.g. SVR, coef_ is a read-only property
+    fitted = vars(model)
+    for attr in ("coef_", "intercept_"):
+        value = fitted.get(attr)
+        if isinstance(value, np.ndarray) and value.dtype == np.float64:
+            setattr(model, attr, value.astype(np.float32))
+    # Stacking/voting/forest ensembles keep their fitted members in a list. A
+    # stacking final_estimator_ is left alone: it sees float64 stacked
+    # predictions, so casting it would only lose precision.
+    sub_models = fitted.get("estimators_")
+    if isinstance(sub_models, list):
+        for sub_model in sub_models:
+            _cast_linear_params_to_float32(sub_model)
+
+
+class BaseEnsemble(NamedTuple):
+    """Fitted models and weights of the XGBoost + stacking + residual ensemble"""
+    tables: ScalingTables
+    xgb_booster: xgb.Booster
+    xgb_iteration_range: Tuple[int, int]
+    stacking_model: object
+    residual_model: object
+    w_xgb: float
+    w_stacking: float
+
+
+def load_base_models(model_dir: str = MODEL_DIR, nthread: int = 1) -> BaseEnsemble:
+    """Load the scaler, base models and ensemble weights from ``model_dir``"""
+    scaler = joblib.load(os.path.join(model_dir, "scaler_1.joblib"))
+    ubj_path = os.path.join(model_dir, "xgb_model_1.ubj")
+    if os.path.exists(ubj_path):
+        # Native XGBoost format written by export_models.py: loads without
+        # unpickling and is independent of the xgboost/sklearn pickle layout
+        best_xgb = xgb.XGBRegressor()
+        best_xgb.load_model(ubj_path)
+    else:
+        best_xgb = joblib.load(os.path.join(model_dir, "xgb_model_1.joblib"))
+    stacking_model = joblib.load(os.path.join(model_dir, "stacking_model_1.joblib"))
+    residual_model = joblib.load(os.path.join(model_dir, "residual_model_1.joblib"))
+
+    with open(os.path.join(model_dir, "ensemble_weights_1.json"), 'r') as f:
+        ensemble_weights = json.load(f)
+
+    # XGBoost already keeps thresholds and leaf values in float32; align the
+    # sklearn models that receive the float32 feature matrix so it is not copied
+    _cast_linear_params_to_float32(stacking_model)
+    _cast_linear_params_to_float32(residual_model)
+
+    # Call the XGBoost booster directly: inplace_predict skips the sklearn
+    # wrapper and DMatrix construction. The API uses one thread per call, since
+    # requests already run in parallel on its inference thread pool.
+    xgb_booster = best_xgb.get_booster()
+    xgb_booster.set_param({"nthread": nthread})
+    try:
+        # Honour early stopping the same way XGBRegressor.predict does
+        xgb_iteration_range = (0, best_xgb.best_iteration + 1)
+    except AttributeError:
+        xgb_iteration_range = (0, 0)
+
+    return BaseEnsemble(
+        tables=build_scaling_tables(scaler),
+        xgb_booster=xgb_booster,
+        xgb_iteration_range=xgb_iteration_range,
+        stacking_model=stacking_model,
+        residual_model=residual_model,
+        w_xgb=float(ensemble_weights['xgb_weight']),
+        w_stacking=float(ensemble_weights['stacking_weight'])
+    )
+
+
+def run_base_ensemble(models: BaseEnsemble, X_scaled):
+    """Weighted XGBoost + stacking ensemble with residual correction, plus confidences"""
+    # Get predictions from base models
+    xgb_pred = models.xgb_booster.inplace_predict(
+        X_scaled,
+        iteration_range=models.xgb_iteration_range,
+        missing=np.nan,
+        validate_features=False
+    )
+    stacking_pred = models.stacking_model.predict(X_scaled)
+    residual_pred = models.residual_model.predict(X_scaled)
+
+    # Combine predictions using optimized weights and apply residual correction
+    final_prediction = np.empty(X_scaled.shape[0])
+    confidence = np.empty(X_scaled.shape[0])
+    _finalize_nb(xgb_pred, stacking_pred, residual_pred, models.w_xgb, models.w_stacking,
+                 final_prediction, confidence)
+    return final_prediction, confidence
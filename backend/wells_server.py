@@ -1,8 +1,11 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Path
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
+import asyncio
 import logging
+import orjson
 from typing import List, Dict, Any
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 import random
 import math
 from datetime import datetime, timedelta
@@ -16,31 +19,106 @@ logger = logging.getLogger(__name__)
 # --------------------------------------------------
 # Initialize FastAPI app
 # --------------------------------------------------
-app = FastAPI(title="Groundwater Wells API", version="1.0.0")
+app = FastAPI(
+    title="Groundwater Wells API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # --------------------------------------------------
 # MongoDB connection
 # --------------------------------------------------
-try:
-    # Connect to MongoDB with a timeout
-    client = MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=5000)
-    # Test the connection
-    client.admin.command('ping')
-    db = client.groundwaterDB
-    wells_collection = db.wells
-    
-    logger.info("✅ Connected to MongoDB successfully")
-    
-    # Check collection stats
-    total_docs = wells_collection.count_documents({})
-    logger.info(f"📊 Found {total_docs:,} documents in wells collection")
+# Motor client: queries yield to the event loop instead of blocking it
+client = AsyncIOMotorClient(
+    "mongodb://localhost:27017/",
+    serverSelectionTimeoutMS=5000,
+    maxPoolSize=50
+)
+db = client.groundwaterDB
+wells_collection = db.wells
+summary_collection = db.wells_summary
+
+# Compound index holding every field the wells aggregations read, so with the
+# leading $project they run as covered index scans without loading documents
+WELLS_COVERING_INDEX = [("LATITUDE", 1), ("LONGITUDE", 1), ("Date", 1), ("DTWL", 1)]
+AGGREGATE_BATCH_SIZE = 1000
+covering_index_ready = False
+
+# GeoJSON point per record backing the /well-details lookup; set once the
+# 2dsphere index from migrate_well_locations.py is found
+locations_indexed = False
+
+# Collection size from metadata (O(1)), refreshed in the background rather
+# than counted per request
+TOTAL_RECORDS_REFRESH_SECONDS = 60
+total_records = 0
+
+# Strong references so the event loop does not drop the refresh tasks
+background_tasks = set()
+
+@app.on_event("startup")
+async def connect_to_mongodb():
+    global client, db, wells_collection, summary_collection, total_records
+    try:
+        # Test the connection
+        await client.admin.command('ping')
+        
+        logger.info("✅ Connected to MongoDB successfully")
+        
+        # Check collection stats
+        total_records = await wells_collection.estimated_document_count()
+        logger.info(f"📊 Found {total_records:,} documents in wells collection")
+        
+    except Exception as e:
+        logger.error(f"❌ MongoDB connection failed: {e}")
+        logger.info("🔄 Continuing without MongoDB - will provide sample data")
+        client = None
+        db = None
+        wells_collection = None
+        summary_collection = None
+        return
     
-except Exception as e:
-    logger.error(f"❌ MongoDB connection failed: {e}")
-    logger.info("🔄 Continuing without MongoDB - will provide sample data")
-    client = None
-    db = None
-    wells_collection = None
+    background_tasks.add(asyncio.create_task(total_records_refresh_loop()))
+    background_tasks.add(asyncio.create_task(wells_summary_refresh_loop()))
+
+async def ensure_indexes():
+    """Create the covering index and detect which indexes queries may rely on"""
+    global covering_index_ready, locations_indexed
+    # Index problems (missing privileges, an equivalent index under another
+    # name) must not take MongoDB offline; queries just run without hints
+    try:
+        await wells_collection.create_index(WELLS_COVERING_INDEX)
+    except Exception as e:
+        logger.error(f"❌ Could not create wells index: {e}")
+    try:
+        index_info = await wells_collection.index_information()
+    except Exception as e:
+        logger.error(f"❌ Could not list wells indexes: {e}")
+        return
+    index_keys = [index["key"] for index in index_info.values()]
+    covering_fields = [field for field, _ in WELLS_COVERING_INDEX]
+    covering_index_ready = any(
+        [field for field, _ in key] == covering_fields for key in index_keys
+    )
+    # Use the geospatial lookup only if the one-time migration has run
+    locations_indexed = any(("location", "2dsphere") in key for key in index_keys)
+
+def aggregate_options():
+    """allowDiskUse, plus the covering index hint once that index exists"""
+    options = {"allowDiskUse": True}
+    if covering_index_ready:
+        options["hint"] = WELLS_COVERING_INDEX
+    return options
+
+async def total_records_refresh_loop():
+    """Keep the cached total record count roughly current"""
+    global total_records
+    while True:
+        await asyncio.sleep(TOTAL_RECORDS_REFRESH_SECONDS)
+        try:
+            total_records = await wells_collection.estimated_document_count()
+        except Exception as e:
+            logger.error(f"❌ Record count refresh failed: {e}")
 
 # --------------------------------------------------
 # Enable CORS (for React Native app)
@@ -53,6 +131,67 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --------------------------------------------------
+# Wells summary (materialized per-location aggregates)
+# --------------------------------------------------
+SUMMARY_REFRESH_SECONDS = 24 * 60 * 60  # Rebuild nightly
+WELLS_LIMIT = 5000  # Limit for mobile performance
+
+# One document per unique well location
+WELLS_SUMMARY_PIPELINE = [
+    # Only carry the fields the group needs
+    {"$project": {"_id": 0, "LATITUDE": 1, "LONGITUDE": 1, "DTWL": 1, "Date": 1}},
+    {
+        "$group": {
+            "_id": {
+                "lat": "$LATITUDE", 
+                "lng": "$LONGITUDE"
+            },
+            "count": {"$sum": 1},
+            "avg_dtwl": {"$avg": "$DTWL"},
+            "min_dtwl": {"$min": "$DTWL"},
+            "max_dtwl": {"$max": "$DTWL"},
+            "latest_date": {"$max": "$Date"},
+            "earliest_date": {"$min": "$Date"}
+        }
+    },
+    {
+        "$project": {
+            "_id": 0,
+            "lat": "$_id.lat",
+            "long": "$_id.lng", 
+            "waterlevel": "$avg_dtwl",
+            "date": "$latest_date",
+            "count": "$count",
+            "min_waterlevel": "$min_dtwl",
+            "max_waterlevel": "$max_dtwl",
+            "earliest_date": "$earliest_date",
+            "latest_date": "$latest_date"
+        }
+    }
+]
+
+async def refresh_wells_summary():
+    """Rebuild the wells_summary collection from the raw wells records"""
+    # $out swaps the new collection in atomically, dropping wells that disappeared
+    await wells_collection.aggregate(
+        WELLS_SUMMARY_PIPELINE + [{"$out": summary_collection.name}],
+        **aggregate_options()
+    ).to_list(length=None)
+    unique_wells = await summary_collection.estimated_document_count()
+    logger.info(f"✅ Rebuilt wells summary: {unique_wells:,} unique locations")
+
+async def wells_summary_refresh_loop():
+    """Ensure indexes, then refresh the wells summary now and on a fixed schedule"""
+    # Index builds run here in the background so startup never waits on them
+    await ensure_indexes()
+    while True:
+        try:
+            await refresh_wells_summary()
+        except Exception as e:
+            logger.error(f"❌ Wells summary refresh failed: {e}")
+        await asyncio.sleep(SUMMARY_REFRESH_SECONDS)
+
 # --------------------------------------------------
 # Wells Data Endpoints
 # --------------------------------------------------
@@ -64,44 +203,20 @@ async def get_wells():
         if wells_collection is not None:
             logger.info("📊 Fetching unique well locations from MongoDB...")
             
-            # Optimized aggregation pipeline for large dataset
-            pipeline = [
-                {
-                    "$group": {
-                        "_id": {
-                            "lat": "$LATITUDE", 
-                            "lng": "$LONGITUDE"
-                        },
-                        "count": {"$sum": 1},
-                        "avg_dtwl": {"$avg": "$DTWL"},
-                        "min_dtwl": {"$min": "$DTWL"},
-                        "max_dtwl": {"$max": "$DTWL"},
-                        "latest_date": {"$max": "$Date"},
-                        "earliest_date": {"$min": "$Date"}
-                    }
-                },
-                {
-                    "$project": {
-                        "_id": 0,
-                        "lat": "$_id.lat",
-                        "long": "$_id.lng", 
-                        "waterlevel": "$avg_dtwl",
-                        "date": "$latest_date",
-                        "count": "$count",
-                        "min_waterlevel": "$min_dtwl",
-                        "max_waterlevel": "$max_dtwl",
-                        "date_range": {
-                            "$concat": ["$earliest_date", " to ", "$latest_date"]
-                        }
-                    }
-                },
-                {"$limit": 5000}  # Limit for mobile performance
-            ]
+            # Served from the precomputed summary collection
+            cursor = summary_collection.find({}, {"_id": 0}, limit=WELLS_LIMIT).batch_size(AGGREGATE_BATCH_SIZE)
+            wells_data = await cursor.to_list(length=WELLS_LIMIT)
             
-            wells_data = list(wells_collection.aggregate(pipeline))
+            if not wells_data:
+                # Summary not built yet - aggregate the raw records directly
+                cursor = wells_collection.aggregate(
+                    WELLS_SUMMARY_PIPELINE + [{"$limit": WELLS_LIMIT}],
+                    batchSize=AGGREGATE_BATCH_SIZE,
+                    **aggregate_options()
+                )
+                wells_data = await cursor.to_list(length=WELLS_LIMIT)
             
             if wells_data:
-                total_records = wells_collection.count_documents({})
                 logger.info(f"✅ Retrieved {len(wells_data)} unique well locations from {total_records:,} total records")
                 return {
                     "success": True,
@@ -113,30 +228,19 @@ async def get_wells():
         
         # Fallback to sample data
         logger.info("📊 Providing sample wells data")
-        sample_wells_data = generate_sample_wells_data()
-        
-        return {
-            "success": True,
-            "count": len(sample_wells_data),
-            "data": sample_wells_data,
-            "source": "sample_data"
-        }
+        return Response(content=SAMPLE_WELLS_JSON, media_type="application/json")
         
     except Exception as e:
         logger.error(f"❌ Error in wells endpoint: {e}")
         # Fallback to sample data on any error
         logger.info("🔄 Falling back to sample data due to error")
-        sample_wells_data = generate_sample_wells_data()
-        
-        return {
-            "success": True,
-            "count": len(sample_wells_data),
-            "data": sample_wells_data,
-            "source": "sample_data_fallback"
-        }
+        return Response(content=SAMPLE_WELLS_FALLBACK_JSON, media_type="application/json")
 
 @app.get("/well-details/{lat}/{lng}")
-async def get_well_details(lat: float, lng: float):
+async def get_well_details(
+    lat: float = Path(..., ge=-90, le=90),
+    lng: float = Path(..., ge=-180, le=180)
+):
     """Get detailed time series data for a specific well location"""
     try:
         if wells_collection is None:
@@ -148,34 +252,52 @@ async def get_well_details(lat: float, lng: float):
             "LATITUDE": {"$gte": lat - tolerance, "$lte": lat + tolerance},
             "LONGITUDE": {"$gte": lng - tolerance, "$lte": lng + tolerance}
         }
+        if locations_indexed:
+            # Migrated records go through the 2dsphere index ($centerSphere
+            # takes its radius in radians); records inserted without a
+            # location are still matched on their coordinates
+            query = {"$or": [
+                {"location": {"$geoWithin": {
+                    "$centerSphere": [[lng, lat], math.radians(tolerance)]
+                }}},
+                {"location": {"$exists": False}, **query}
+            ]}
+        
+        # Time series and statistics in one round trip, computed server-side
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"Date": 1}},
+            {"$limit": 365},  # Limit to 1 year of data for performance
+            {"$facet": {
+                "series": [
+                    {"$project": {
+                        "_id": 0,
+                        "date": "$Date",
+                        "waterlevel": "$DTWL",
+                        "lat": "$LATITUDE",
+                        "long": "$LONGITUDE"
+                    }}
+                ],
+                "stats": [
+                    {"$group": {
+                        "_id": None,
+                        "average": {"$avg": "$DTWL"},
+                        "minimum": {"$min": "$DTWL"},
+                        "maximum": {"$max": "$DTWL"}
+                    }}
+                ]
+            }}
+        ]
         
-        # Get time series data sorted by date
-        well_records = list(wells_collection.find(
-            query, 
-            {"_id": 0, "LATITUDE": 1, "LONGITUDE": 1, "Date": 1, "DTWL": 1}
-        ).sort("Date", 1).limit(365))  # Limit to 1 year of data for performance
+        result = await wells_collection.aggregate(pipeline).to_list(length=1)
+        processed_data = result[0]["series"] if result else []
         
-        if not well_records:
+        if not processed_data:
             raise HTTPException(status_code=404, detail="No data found for this location")
         
-        # Process data for visualization
-        processed_data = []
-        for record in well_records:
-            processed_data.append({
-                "date": record["Date"],
-                "waterlevel": record["DTWL"],
-                "lat": record["LATITUDE"],
-                "long": record["LONGITUDE"]
-            })
-        
-        # Calculate statistics
-        water_levels = [r["DTWL"] for r in well_records]
-        stats = {
-            "average": sum(water_levels) / len(water_levels),
-            "minimum": min(water_levels),
-            "maximum": max(water_levels),
-            "trend": "stable"  # Could calculate actual trend
-        }
+        stats = result[0]["stats"][0]
+        stats.pop("_id", None)
+        stats["trend"] = "stable"  # Could calculate actual trend
         
         return {
             "success": True,
@@ -229,6 +351,20 @@ def generate_sample_wells_data():
     
     return sample_data
 
+def sample_wells_json(sample_wells_data, source):
+    """Serialize a sample wells response body"""
+    return orjson.dumps({
+        "success": True,
+        "count": len(sample_wells_data),
+        "data": sample_wells_data,
+        "source": source
+    })
+
+# Sample data is generated and serialized once; fallbacks just send the bytes
+SAMPLE_WELLS_DATA = generate_sample_wells_data()
+SAMPLE_WELLS_JSON = sample_wells_json(SAMPLE_WELLS_DATA, "sample_data")
+SAMPLE_WELLS_FALLBACK_JSON = sample_wells_json(SAMPLE_WELLS_DATA, "sample_data_fallback")
+
 @app.get("/wells/summary")
 async def get_wells_summary():
     """Get wells summary statistics from MongoDB"""
@@ -236,11 +372,9 @@ async def get_wells_summary():
         if wells_collection is None:
             return {"message": "MongoDB not available, using sample data"}
         
-        # Get basic statistics
-        total_records = wells_collection.count_documents({})
-        
         # Get date range
         date_pipeline = [
+            {"$project": {"_id": 0, "Date": 1, "DTWL": 1}},
             {"$group": {
                 "_id": None,
                 "min_date": {"$min": "$Date"},
@@ -249,14 +383,17 @@ async def get_wells_summary():
             }}
         ]
         
-        date_stats = list(wells_collection.aggregate(date_pipeline))
+        date_stats = await wells_collection.aggregate(
+            date_pipeline,
+            **aggregate_options()
+        ).to_list(length=1)
         
         # Get unique locations count
-        unique_locations = wells_collection.aggregate([
+        unique_count = await wells_collection.aggregate([
+            {"$project": {"_id": 0, "LATITUDE": 1, "LONGITUDE": 1}},
             {"$group": {"_id": {"lat": "$LATITUDE", "lng": "$LONGITUDE"}}},
             {"$count": "unique_wells"}
-        ])
-        unique_count = list(unique_locations)
+        ], **aggregate_options()).to_list(length=1)
         
         logger.info(f"✅ Summary: {total_records:,} records, {unique_count[0]['unique_wells'] if unique_count else 0} unique locations")
         
@@ -279,7 +416,7 @@ async def health_check():
         "status": "healthy",
         "service": "Wells Data API",
         "mongodb_connected": wells_collection is not None,
-        "total_records": wells_collection.count_documents({}) if wells_collection else 0
+        "total_records": total_records if wells_collection is not None else 0
     }
 
 @app.get("/")
@@ -294,8 +431,8 @@ async def root():
             "/wells/summary": "Get wells summary statistics",
             "/health": "Health check"
         },
-        "mongodb_status": "connected" if wells_collection else "disconnected",
-        "total_records": wells_collection.count_documents({}) if wells_collection else 0
+        "mongodb_status": "connected" if wells_collection is not None else "disconnected",
+        "total_records": total_records if wells_collection is not None else 0
     }
 
 if __name__ == "__main__":
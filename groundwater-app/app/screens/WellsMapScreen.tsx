@@ -116,7 +116,9 @@ export default function DashboardScreen() {
         count: well.count,
         min_waterlevel: well.min_waterlevel,
         max_waterlevel: well.max_waterlevel,
-        dateRange: well.date_range
+        dateRange: well.earliest_date && well.latest_date
+          ? `${well.earliest_date} to ${well.latest_date}`
+          : undefined
       }));
       
       setWells(processedWells);